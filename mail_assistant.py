@@ -11,6 +11,8 @@ import subprocess
 import tempfile
 from pathlib import Path
 
+from provider_pool import get_default_pool
+
 # Dummy data if no OpenAI key
 DUMMY_RESPONSES = {
     "summary": "Bejövő email összefoglaló (teszt mód - add meg az OpenAI kulcsot!)",
@@ -23,8 +25,8 @@ DUMMY_RESPONSES = {
 }
 
 def has_openai_key():
-    """Check if OpenAI API key is available"""
-    return bool(os.getenv("OPENAI_API_KEY"))
+    """Check if any API endpoint is configured (key or local server)"""
+    return get_default_pool().configured()
 
 def get_selected_mail():
     """Get selected mail content from Mail app"""
@@ -50,10 +52,7 @@ def call_openai(prompt, model="gpt-4o-mini"):
         return "TESZT VÁLASZ - Add meg az OpenAI API kulcsot!"
     
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-        
-        response = client.chat.completions.create(
+        response = get_default_pool().create(
             model=model,
             messages=[
                 {"role": "system", "content": "You are a helpful email assistant."},
@@ -10,18 +10,17 @@ import subprocess
 import tempfile
 from pathlib import Path
 
+from provider_pool import get_default_pool
+
 def has_openai_key():
-    return bool(os.getenv("OPENAI_API_KEY"))
+    return get_default_pool().configured()
 
 def call_openai(prompt, model="gpt-4o-mini"):
     if not has_openai_key():
         return f"TESZT VÁLASZ: {prompt[:50]}... (OpenAI kulcs szükséges)"
     
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-        
-        response = client.chat.completions.create(
+        response = get_default_pool().create(
             model=model,
             messages=[
                 {"role": "system", "content": "You are a professional email assistant."},
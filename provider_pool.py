@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+provider_pool.py – Pool of OpenAI-compatible endpoints with latency-aware
+routing, automatic failover and per-endpoint circuit breaking.
+
+Endpoints are read from api_config.yaml:
+
+    api_providers:
+      openai:
+        endpoints:
+          - name: primary
+            base_url: https://api.openai.com/v1
+            api_key_env: OPENAI_API_KEY
+          - name: local
+            base_url: http://127.0.0.1:8000/v1
+            api_key: local
+            models: [gpt-4o-mini]
+    pool:
+      window: 20
+      failure_threshold: 3
+      cooldown: 30
+      max_age: 300
+
+Endpoints without api_key or api_key_env only get OPENAI_API_KEY when they
+point at api.openai.com, so the OpenAI key never leaks to other servers.
+
+Latency samples and circuit states are saved to a small JSON state file
+(pool.state_file, ~/.cache/instant-reply/provider_pool.json by default),
+so the short-lived scripts keep routing on what earlier runs measured.
+
+Any server speaking the OpenAI chat completions API can be listed, so a
+local stand-in server is enough to exercise routing and failover.
+"""
+
+import os
+import json
+import time
+import threading
+from collections import deque
+from pathlib import Path
+
+CONFIG_PATH = Path(__file__).resolve().parent / "api_config.yaml"
+
+DEFAULT_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_KEY_ENV = "OPENAI_API_KEY"
+STATE_PATH = Path.home() / ".cache" / "instant-reply" / "provider_pool.json"
+
+DEFAULT_POOL_SETTINGS = {
+    "window": 20,               # calls kept per endpoint for rolling stats
+    "max_age": 300.0,           # seconds before a sample drops out of the stats
+    "failure_threshold": 3,     # consecutive failures that open the circuit
+    "error_rate_threshold": 0.5,
+    "min_samples": 5,           # calls needed before the error rate counts
+    "cooldown": 30.0,           # seconds an open circuit waits before a probe
+    "timeout": None,            # per-request timeout, None keeps the SDK default
+    "max_retries": None,        # SDK retries, None: SDK default for a single
+                                # endpoint, 0 when the pool fails over instead
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class PoolExhaustedError(RuntimeError):
+    """Raised when every endpoint failed or is unavailable."""
+
+
+def split_model(model):
+    """Split a "provider/model" string into (provider, model)."""
+    if model and "/" in model:
+        provider, name = model.split("/", 1)
+        return provider, name
+    return None, model
+
+
+def is_retryable(exc):
+    """Errors worth retrying on another endpoint.
+
+    Any error response from the endpoint triggers a failover: besides
+    rate limits and server errors, auth and not-found errors depend on
+    the endpoint's own key and models. Only a malformed request (400,
+    422) and errors raised before anything was sent (caller bugs) would
+    fail the same way everywhere, so those are passed through untouched.
+    """
+    import openai
+    if isinstance(exc, openai.APIConnectionError):
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        return exc.status_code not in (400, 422)
+    return False
+
+
+class Endpoint:
+    """One OpenAI-compatible endpoint with rolling health statistics."""
+
+    def __init__(self, name, base_url=DEFAULT_BASE_URL, api_key=None,
+                 models=None, settings=None, client_factory=None):
+        self.name = name
+        self.base_url = base_url
+        self.api_key = api_key
+        self.models = set(models) if models else None
+        self.settings = dict(DEFAULT_POOL_SETTINGS, **(settings or {}))
+        self._client_factory = client_factory
+        self._client = None
+
+        # (ok, latency, timestamp) of the most recent calls
+        self.calls = deque(maxlen=int(self.settings["window"]))
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self._probing = False
+
+    def serves(self, model):
+        return self.models is None or model in self.models
+
+    @property
+    def configured(self):
+        """Whether the endpoint can be called: it has a key or is self-hosted."""
+        return bool(self.api_key) or self.base_url.rstrip("/") != DEFAULT_BASE_URL
+
+    @property
+    def client(self):
+        if self._client is None:
+            if self._client_factory is not None:
+                self._client = self._client_factory(self)
+            else:
+                from openai import OpenAI
+                options = {}
+                if self.settings["timeout"] is not None:
+                    options["timeout"] = self.settings["timeout"]
+                if self.settings["max_retries"] is not None:
+                    options["max_retries"] = self.settings["max_retries"]
+                self._client = OpenAI(api_key=self.api_key or "none",
+                                      base_url=self.base_url, **options)
+        return self._client
+
+    @property
+    def latency(self):
+        """Mean latency of the successful calls in the window, or None."""
+        samples = [lat for ok, lat, _ in self.calls if ok]
+        if not samples:
+            return None
+        return sum(samples) / len(samples)
+
+    @property
+    def error_rate(self):
+        if not self.calls:
+            return 0.0
+        return sum(1 for ok, _, _ in self.calls if not ok) / len(self.calls)
+
+    @property
+    def score(self):
+        """Routing cost, lower is better.
+
+        Unmeasured endpoints score 0 so they get measured; the mean latency
+        is scaled up by the error rate, and an endpoint with failures only
+        goes last.
+        """
+        if not self.calls:
+            return 0.0
+        latency = self.latency
+        if latency is None:
+            return float("inf")
+        return latency / (1.0 - self.error_rate)
+
+    def prune(self, now):
+        """Drop samples older than max_age, so idle endpoints get re-measured."""
+        while self.calls and now - self.calls[0][2] > self.settings["max_age"]:
+            self.calls.popleft()
+
+    def available(self, now):
+        """Whether the endpoint may take a request right now."""
+        self.prune(now)
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and now - self.opened_at >= self.settings["cooldown"]:
+            self.state = HALF_OPEN
+        # A half-open circuit lets a single probe through
+        return self.state == HALF_OPEN and not self._probing
+
+    def acquire(self, now):
+        """Claim the endpoint for one request; False if it is unavailable."""
+        if not self.available(now):
+            return False
+        if self.state == HALF_OPEN:
+            self._probing = True
+        return True
+
+    def release(self):
+        self._probing = False
+
+    def record_success(self, latency, now):
+        if self.state != CLOSED:
+            # The probe went through: start over instead of letting the
+            # failures that opened the circuit reopen it right away
+            self.calls.clear()
+        self.calls.append((True, latency, now))
+        self.consecutive_failures = 0
+        self.state = CLOSED
+
+    def record_failure(self, latency, now):
+        self.calls.append((False, latency, now))
+        self.consecutive_failures += 1
+        if (self.state == HALF_OPEN
+                or self.consecutive_failures >= self.settings["failure_threshold"]
+                or (len(self.calls) >= self.settings["min_samples"]
+                    and self.error_rate >= self.settings["error_rate_threshold"])):
+            self.state = OPEN
+            self.opened_at = now
+
+    def dump_state(self, offset):
+        """Health state for the state file; `offset` turns clock into wall time."""
+        return {
+            "base_url": self.base_url,
+            "calls": [[ok, lat, when + offset] for ok, lat, when in self.calls],
+            "consecutive_failures": self.consecutive_failures,
+            # A probe does not outlive the process, the circuit is open again
+            "state": CLOSED if self.state == CLOSED else OPEN,
+            "opened_at": self.opened_at + offset,
+        }
+
+    def load_state(self, data, offset):
+        """Restore dump_state() output; ignored if the endpoint has moved."""
+        if data.get("base_url") != self.base_url:
+            return
+        self.calls.extend((bool(ok), float(lat), float(when) - offset)
+                          for ok, lat, when in data.get("calls", []))
+        self.consecutive_failures = int(data.get("consecutive_failures", 0))
+        self.state = OPEN if data.get("state") == OPEN else CLOSED
+        self.opened_at = float(data.get("opened_at", 0.0)) - offset
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "base_url": self.base_url,
+            "state": self.state,
+            "latency": self.latency,
+            "error_rate": self.error_rate,
+            "calls": len(self.calls),
+        }
+
+
+class ProviderPool:
+    """Routes chat completions to the fastest healthy endpoint."""
+
+    def __init__(self, endpoints, default_model=None, clock=time.monotonic,
+                 state_path=None, wall_clock=time.time):
+        if not endpoints:
+            raise ValueError("ProviderPool needs at least one endpoint")
+        self.endpoints = list(endpoints)
+        self.default_model = default_model
+        self.state_path = Path(state_path) if state_path else None
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._lock = threading.RLock()
+        if len(self.endpoints) > 1:
+            # Fail over to the next endpoint rather than retrying in the SDK
+            for ep in self.endpoints:
+                if ep.settings["max_retries"] is None:
+                    ep.settings["max_retries"] = 0
+        self._load_state()
+
+    def _clock_offset(self):
+        """Difference between wall time and the (monotonic) routing clock."""
+        return self._wall_clock() - self._clock()
+
+    def _load_state(self):
+        if self.state_path is None:
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        offset = self._clock_offset()
+        for ep in self.endpoints:
+            try:
+                ep.load_state(saved.get(ep.name) or {}, offset)
+            except (TypeError, ValueError):
+                pass  # corrupt entry, start this endpoint fresh
+
+    def _save_state(self):
+        """Write the health state; best effort, routing works without it."""
+        if self.state_path is None:
+            return
+        offset = self._clock_offset()
+        saved = {ep.name: ep.dump_state(offset) for ep in self.endpoints}
+        tmp = self.state_path.with_name(self.state_path.name + ".tmp")
+        try:
+            self.state_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(saved, f)
+            os.replace(tmp, self.state_path)
+        except OSError:
+            pass
+
+    @classmethod
+    def from_config(cls, path=CONFIG_PATH, provider=None, client_factory=None,
+                    env=None, state_path=None):
+        """Build a pool from api_config.yaml.
+
+        Keys named by api_key_env are looked up in `env` (os.environ by
+        default). Falls back to a single api.openai.com endpoint keyed by
+        OPENAI_API_KEY when the file or the endpoints list is missing.
+        Health state is kept in `state_path`, else pool.state_file, else
+        STATE_PATH.
+        """
+        env = os.environ if env is None else env
+        config = {}
+        path = Path(path)
+        if path.exists():
+            import yaml
+            with open(path, encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+
+        default_provider, default_model = split_model(config.get("default_model"))
+        provider = provider or default_provider or "openai"
+        provider_cfg = (config.get("api_providers") or {}).get(provider) or {}
+        settings = dict(DEFAULT_POOL_SETTINGS, **(config.get("pool") or {}))
+
+        entries = provider_cfg.get("endpoints") or [
+            {"name": provider, "base_url": DEFAULT_BASE_URL}
+        ]
+        endpoints = []
+        for i, entry in enumerate(entries):
+            base_url = entry.get("base_url", DEFAULT_BASE_URL)
+            key_env = entry.get("api_key_env")
+            if key_env is None and base_url.rstrip("/") == DEFAULT_BASE_URL:
+                key_env = DEFAULT_KEY_ENV
+            api_key = entry.get("api_key")
+            if api_key is None and key_env:
+                api_key = env.get(key_env)
+            endpoints.append(Endpoint(
+                name=entry.get("name", f"{provider}-{i}"),
+                base_url=base_url,
+                api_key=api_key,
+                models=entry.get("models"),
+                settings=dict(settings, **(entry.get("pool") or {})),
+                client_factory=client_factory,
+            ))
+        if state_path is None:
+            state_path = settings.get("state_file") or STATE_PATH
+        return cls(endpoints, default_model=default_model,
+                   state_path=Path(state_path).expanduser())
+
+    def configured(self):
+        """Whether any endpoint has a key or is a self-hosted server."""
+        return any(ep.configured for ep in self.endpoints)
+
+    def ranked(self, model=None):
+        """Endpoints that may take a request for `model`, best first.
+
+        Endpoints without a usable key, with an open circuit still inside
+        their cooldown, or half-open with a probe already running are
+        left out.
+        """
+        with self._lock:
+            now = self._clock()
+            candidates = [ep for ep in self.endpoints
+                          if ep.configured and ep.serves(model)
+                          and ep.available(now)]
+            return sorted(candidates, key=lambda ep: (ep.score, ep.error_rate))
+
+    def _acquire(self, model, tried):
+        with self._lock:
+            now = self._clock()
+            for ep in self.ranked(model):
+                if ep not in tried and ep.acquire(now):
+                    return ep
+            return None
+
+    def create(self, **kwargs):
+        """Drop-in for client.chat.completions.create with failover."""
+        model = kwargs.get("model") or self.default_model
+        _, kwargs["model"] = split_model(model)
+
+        tried = []
+        last_error = None
+        while True:
+            ep = self._acquire(kwargs["model"], tried)
+            if ep is None:
+                break
+            tried.append(ep)
+            start = self._clock()
+            try:
+                response = ep.client.chat.completions.create(**kwargs)
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                with self._lock:
+                    ep.record_failure(self._clock() - start, self._clock())
+                    self._save_state()
+                last_error = e
+            else:
+                with self._lock:
+                    ep.record_success(self._clock() - start, self._clock())
+                    self._save_state()
+                return response
+            finally:
+                with self._lock:
+                    ep.release()
+
+        if not tried:
+            raise PoolExhaustedError(
+                f"No available endpoint for model {kwargs['model']!r}")
+        raise PoolExhaustedError(
+            f"All {len(tried)} endpoint(s) failed: {last_error}") from last_error
+
+    def stats(self):
+        with self._lock:
+            return [ep.stats() for ep in self.endpoints]
+
+
+_default_pool = None
+
+
+def get_default_pool():
+    """Pool built from api_config.yaml, shared by the whole process."""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ProviderPool.from_config()
+    return _default_pool
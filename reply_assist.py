@@ -6,7 +6,7 @@ reply_assist.py – Mail reply assistant with OpenAI integration
 
 import os, sys, json, argparse, pathlib, subprocess
 from langdetect import detect
-from openai import OpenAI
+from provider_pool import ProviderPool
 
 ROOT = pathlib.Path(__file__).resolve().parents[1]
 
@@ -20,8 +20,8 @@ def load_key():
     cfg.read(ROOT / "config/config.ini")
     return cfg["OpenAI"]["api_key"].strip()
 
-def chat(client, model, system, user):
-    resp = client.chat.completions.create(
+def chat(pool, model, system, user):
+    resp = pool.create(
         model=model,
         temperature=0.4,
         messages=[{"role":"system","content":system},
@@ -29,26 +29,26 @@ def chat(client, model, system, user):
     )
     return resp.choices[0].message.content.strip()
 
-def short_summary(client, model, email):
+def short_summary(pool, model, email):
     sys_msg = "Rövidítsd egy mondatba magyarul a megadott e-mail tartalmát."
-    return chat(client, model, sys_msg, email)
+    return chat(pool, model, sys_msg, email)
 
-def three_replies(client, model, email):
+def three_replies(pool, model, email):
     prompt = ("Írj három rövid, segítőkész válaszlehetőséget magyarul "
               "az alábbi levélre, vesszővel elválasztva, hosszuk 3–7 szó legyen.\n\n"
               f"{email}")
-    text = chat(client, model, "Dupla idézőjelek nélkül add meg a három opciót.", prompt)
+    text = chat(pool, model, "Dupla idézőjelek nélkül add meg a három opciót.", prompt)
     raw = [x.strip().lstrip("–-•0123456789. ") for x in text.split(",")]
     return [r for r in raw if r][:3]  # max 3 option
 
-def elegant_reply(client, model, email, draft, lang):
+def elegant_reply(pool, model, email, draft, lang):
     sys_msg = (f"You are an assistant that drafts polite, elegant e-mail replies in {lang}. "
                "Use formal yet friendly style.")
     user_msg = (f"SOURCE EMAIL:\n{email}\n\n"
                 f"DRAFT REPLY: {draft}\n\n"
                 "Rewrite the DRAFT into a full, well-structured reply. "
                 "Keep salutations and signatures neutral.")
-    return chat(client, model, sys_msg, user_msg)
+    return chat(pool, model, sys_msg, user_msg)
 
 def get_mail_content():
     script = """
@@ -106,16 +106,23 @@ def main():
         # Get mail content
         email = get_mail_content()
 
-        # Setup OpenAI
-        client = OpenAI(api_key=load_key())
+        # Setup OpenAI endpoint pool (api_config.yaml)
+        env = dict(os.environ)
+        try:
+            env["OPENAI_API_KEY"] = load_key()
+        except KeyError:
+            pass  # no OpenAI key, a keyed or local endpoint may still be set up
+        pool = ProviderPool.from_config(env=env)
+        if not pool.configured():
+            raise Exception("No OpenAI API key or endpoint configured")
         model = "gpt-4o-mini"
 
         # Detect language
         lang = detect(email)
 
         # Generate summary and options
-        summary = short_summary(client, model, email)
-        options = three_replies(client, model, email)
+        summary = short_summary(pool, model, email)
+        options = three_replies(pool, model, email)
 
         # Ensure we have 3 options
         while len(options) < 3:
@@ -137,7 +144,7 @@ def main():
             reply = choice
 
         # Generate elegant reply
-        final_reply = elegant_reply(client, model, email, reply, lang)
+        final_reply = elegant_reply(pool, model, email, reply, lang)
 
         # Paste to Mail
         paste_to_mail(final_reply)
@@ -0,0 +1,388 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+from provider_pool import (
+    CLOSED, HALF_OPEN, OPEN, DEFAULT_BASE_URL, Endpoint, PoolExhaustedError,
+    ProviderPool,
+)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def status_error(status):
+    response = SimpleNamespace(status_code=status, request=None, headers={})
+    return openai.APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+class FakeClient:
+    """Stands in for OpenAI(); `behaviour` is a latency or an exception."""
+
+    def __init__(self, clock, behaviour):
+        self.clock = clock
+        self.behaviour = behaviour
+        self.calls = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        self.calls += 1
+        if isinstance(self.behaviour, BaseException):
+            raise self.behaviour
+        self.clock.now += self.behaviour
+        return kwargs["model"]
+
+
+def make_pool(behaviours, **settings):
+    clock = Clock()
+    clients = {name: FakeClient(clock, b) for name, b in behaviours.items()}
+    endpoints = [Endpoint(name, api_key="sk-test", settings=settings,
+                          client_factory=lambda ep: clients[ep.name])
+                 for name in behaviours]
+    return ProviderPool(endpoints, clock=clock), clients, clock
+
+
+def test_routes_to_fastest_endpoint():
+    pool, clients, _ = make_pool({"slow": 0.5, "fast": 0.1})
+    for _ in range(5):
+        pool.create(model="gpt-4o-mini", messages=[])
+    # Each endpoint is measured once, then the fast one takes the rest
+    assert clients["slow"].calls == 1
+    assert clients["fast"].calls == 4
+
+
+def test_strips_provider_prefix_and_uses_default_model():
+    pool, _, _ = make_pool({"a": 0.1})
+    pool.default_model = "openai/gpt-4o-mini"
+    assert pool.create(messages=[]) == "gpt-4o-mini"
+    assert pool.create(model="openai/gpt-4o", messages=[]) == "gpt-4o"
+
+
+def test_fails_over_on_server_error():
+    pool, clients, _ = make_pool({"down": status_error(503), "up": 0.3})
+    pool.endpoints[1].calls.append((True, 1.0, 0.0))  # "down" goes first
+    assert pool.create(model="m", messages=[]) == "m"
+    assert clients["down"].calls == 1
+    assert clients["up"].calls == 1
+
+
+def test_fails_over_on_connection_error():
+    error = openai.APIConnectionError(request=None)
+    pool, clients, _ = make_pool({"down": error, "up": 0.3})
+    pool.create(model="m", messages=[])
+    assert clients["up"].calls == 1
+
+
+def test_circuit_opens_after_threshold_and_skips_during_cooldown():
+    pool, clients, clock = make_pool({"only": status_error(503)},
+                                     failure_threshold=3, cooldown=30)
+    for _ in range(3):
+        with pytest.raises(PoolExhaustedError):
+            pool.create(model="m", messages=[])
+    assert pool.endpoints[0].state == OPEN
+
+    clock.now += 10
+    for _ in range(3):
+        with pytest.raises(PoolExhaustedError, match="No available endpoint"):
+            pool.create(model="m", messages=[])
+    assert clients["only"].calls == 3
+
+
+def test_half_open_lets_one_probe_through_and_closes():
+    pool, clients, clock = make_pool({"only": status_error(503)},
+                                     failure_threshold=3, cooldown=30)
+    for _ in range(3):
+        with pytest.raises(PoolExhaustedError):
+            pool.create(model="m", messages=[])
+    ep = pool.endpoints[0]
+
+    clock.now += 31
+    assert ep.acquire(clock.now)
+    assert ep.state == HALF_OPEN
+    # A second caller is turned away while the probe runs
+    with pytest.raises(PoolExhaustedError, match="No available endpoint"):
+        pool.create(model="m", messages=[])
+    ep.release()
+
+    clients["only"].behaviour = 0.1
+    pool.create(model="m", messages=[])
+    assert ep.state == CLOSED
+    assert ep.error_rate == 0.0
+    # Old failures are gone, one new failure does not reopen the circuit
+    clients["only"].behaviour = status_error(503)
+    with pytest.raises(PoolExhaustedError):
+        pool.create(model="m", messages=[])
+    assert ep.state == CLOSED
+
+
+def test_failed_probe_reopens_circuit():
+    pool, clients, clock = make_pool({"only": status_error(500)},
+                                     failure_threshold=1, cooldown=30)
+    with pytest.raises(PoolExhaustedError):
+        pool.create(model="m", messages=[])
+    clock.now += 31
+    with pytest.raises(PoolExhaustedError, match="failed"):
+        pool.create(model="m", messages=[])
+    assert pool.endpoints[0].state == OPEN
+    assert clients["only"].calls == 2
+
+
+def test_probe_is_released_on_base_exception():
+    pool, clients, clock = make_pool({"only": status_error(500)},
+                                     failure_threshold=1, cooldown=30)
+    with pytest.raises(PoolExhaustedError):
+        pool.create(model="m", messages=[])
+    clock.now += 31
+    clients["only"].behaviour = KeyboardInterrupt()
+    with pytest.raises(KeyboardInterrupt):
+        pool.create(model="m", messages=[])
+    assert pool.endpoints[0].available(clock.now)
+
+
+@pytest.mark.parametrize("status", [401, 403, 404])
+def test_endpoint_specific_errors_fail_over(status):
+    pool, clients, _ = make_pool({"a": status_error(status), "b": 0.1})
+    pool.endpoints[1].calls.append((True, 1.0, 0.0))  # "a" goes first
+    assert pool.create(model="m", messages=[]) == "m"
+    assert clients["b"].calls == 1
+
+
+def test_unkeyed_default_endpoint_is_skipped():
+    clock = Clock()
+    local = FakeClient(clock, 0.1)
+    pool = ProviderPool([
+        Endpoint("openai"),
+        Endpoint("local", base_url="http://127.0.0.1:8000/v1", api_key="local",
+                 client_factory=lambda ep: local),
+    ], clock=clock)
+    assert pool.configured()
+    assert [ep.name for ep in pool.ranked("m")] == ["local"]
+    assert pool.create(model="m", messages=[]) == "m"
+    assert local.calls == 1
+
+
+@pytest.mark.parametrize("error", [status_error(400), status_error(422),
+                                   TypeError("bad argument")])
+def test_non_retryable_errors_pass_through(error):
+    pool, clients, _ = make_pool({"a": error, "b": 0.1})
+    pool.endpoints[1].calls.append((True, 1.0, 0.0))  # "a" goes first
+    with pytest.raises(type(error)):
+        pool.create(model="m", messages=[])
+    assert clients["b"].calls == 0
+    assert len(pool.endpoints[0].calls) == 0
+    assert pool.endpoints[0].state == CLOSED
+
+
+def test_endpoint_with_only_failures_ranks_last():
+    pool, _, clock = make_pool({"flaky": 0.1, "steady": 0.5})
+    flaky, steady = pool.endpoints
+    flaky.calls.append((False, 0.1, clock.now))
+    steady.calls.append((True, 0.5, clock.now))
+    assert pool.ranked("m") == [steady, flaky]
+
+
+def test_stale_endpoints_are_measured_again():
+    pool, clients, clock = make_pool({"slow": 0.5, "fast": 0.1}, max_age=60)
+    for _ in range(3):
+        pool.create(model="m", messages=[])
+    assert clients["slow"].calls == 1
+    clock.now += 61
+    pool.create(model="m", messages=[])
+    assert clients["slow"].calls == 2
+
+
+def test_models_filter():
+    pool, clients, _ = make_pool({"a": 0.1, "b": 0.1})
+    pool.endpoints[0].models = {"local-model"}
+    pool.create(model="gpt-4o", messages=[])
+    assert clients["a"].calls == 0
+    assert clients["b"].calls == 1
+
+
+def test_state_is_shared_between_pools(tmp_path):
+    state = tmp_path / "state.json"
+    clock, wall = Clock(), Clock()
+    wall.now = 1_000_000.0
+    clients = {"slow": FakeClient(clock, 0.5),
+               "fast": FakeClient(clock, 0.1),
+               "down": FakeClient(clock, status_error(503))}
+
+    def build():
+        endpoints = [Endpoint(name, api_key="sk-test",
+                              settings={"failure_threshold": 1, "cooldown": 30},
+                              client_factory=lambda ep: clients[ep.name])
+                     for name in ("down", "slow", "fast")]
+        return ProviderPool(endpoints, clock=clock, wall_clock=wall,
+                            state_path=state)
+
+    first = build()
+    for _ in range(3):
+        first.create(model="m", messages=[])
+    # down fails over to slow, then fast is measured and wins
+    assert [c.calls for c in clients.values()] == [1, 2, 1]
+
+    # A new process: fresh monotonic clock, wall time moved on a little
+    clock.now, wall.now = 0.0, wall.now + 5
+    second = build()
+    down, slow, fast = second.endpoints
+    assert down.state == OPEN
+    assert [ep.name for ep in second.ranked("m")] == ["fast", "slow"]
+    second.create(model="m", messages=[])
+    assert [c.calls for c in clients.values()] == [1, 3, 1]
+
+    # The cooldown keeps counting across processes
+    clock.now, wall.now = 0.0, wall.now + 30
+    assert build().endpoints[0].available(clock.now)
+
+
+def test_corrupt_state_file_is_ignored(tmp_path):
+    state = tmp_path / "state.json"
+    state.write_text("{not json", encoding="utf-8")
+    pool = ProviderPool([Endpoint("a", api_key="sk-test")], state_path=state)
+    assert pool.endpoints[0].state == CLOSED
+
+
+def test_sdk_retries_disabled_only_when_failing_over():
+    single = ProviderPool([Endpoint("a")])
+    assert single.endpoints[0].settings["max_retries"] is None
+    several = ProviderPool([Endpoint("a"), Endpoint("b")])
+    assert all(ep.settings["max_retries"] == 0 for ep in several.endpoints)
+
+
+def test_from_config_fallback(tmp_path):
+    pool = ProviderPool.from_config(tmp_path / "missing.yaml",
+                                    env={"OPENAI_API_KEY": "sk-test"},
+                                    state_path=tmp_path / "state.json")
+    [ep] = pool.endpoints
+    assert ep.base_url == DEFAULT_BASE_URL
+    assert ep.api_key == "sk-test"
+    assert pool.configured()
+    assert not ProviderPool.from_config(tmp_path / "missing.yaml", env={},
+                                        state_path=tmp_path / "state.json").configured()
+
+
+def test_from_config_endpoints(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "api_config.yaml"
+    path.write_text(
+        "api_providers:\n"
+        "  openai:\n"
+        "    endpoints:\n"
+        "      - name: primary\n"
+        "        api_key_env: PRIMARY_KEY\n"
+        "      - name: local\n"
+        "        base_url: http://127.0.0.1:8000/v1\n"
+        "        models: [gpt-4o-mini]\n"
+        "        pool: {cooldown: 5}\n"
+        'default_model: "openai/gpt-4o-mini"\n'
+        "pool:\n"
+        "  failure_threshold: 2\n",
+        encoding="utf-8")
+    pool = ProviderPool.from_config(path, env={"PRIMARY_KEY": "sk-primary"},
+                                    state_path=tmp_path / "state.json")
+    primary, local = pool.endpoints
+    assert pool.default_model == "gpt-4o-mini"
+    assert primary.api_key == "sk-primary"
+    assert local.api_key is None and local.configured
+    assert local.models == {"gpt-4o-mini"}
+    assert local.settings["cooldown"] == 5
+    assert primary.settings["failure_threshold"] == 2
+
+
+def test_from_config_keeps_openai_key_off_other_servers(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "api_config.yaml"
+    path.write_text(
+        "api_providers:\n"
+        "  openai:\n"
+        "    endpoints:\n"
+        "      - name: openai\n"
+        "        base_url: https://api.openai.com/v1\n"
+        "      - name: local\n"
+        "        base_url: http://127.0.0.1:8000/v1\n",
+        encoding="utf-8")
+    pool = ProviderPool.from_config(path, env={"OPENAI_API_KEY": "sk-secret"},
+                                    state_path=tmp_path / "state.json")
+    openai_ep, local = pool.endpoints
+    assert openai_ep.api_key == "sk-secret"
+    assert local.api_key is None
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Minimal OpenAI-compatible chat completions server."""
+
+    def do_POST(self):
+        self.server.hits += 1
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        if self.server.status != 200:
+            self.send_response(self.server.status)
+            self.end_headers()
+            return
+        payload = json.dumps({
+            "id": "chatcmpl-test",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": self.server.reply},
+            }],
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in():
+    servers = []
+
+    def start(status=200, reply="ok"):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), StandInHandler)
+        server.status, server.reply, server.hits = status, reply, 0
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        server.base_url = f"http://127.0.0.1:{server.server_port}/v1"
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_failover_against_local_servers(stand_in):
+    broken = stand_in(status=503)
+    healthy = stand_in(reply="hello")
+    pool = ProviderPool([
+        Endpoint("broken", base_url=broken.base_url, api_key="local",
+                 settings={"failure_threshold": 1}),
+        Endpoint("healthy", base_url=healthy.base_url, api_key="local"),
+    ])
+    pool.endpoints[1].calls.append((True, 1.0, pool._clock()))  # "broken" first
+
+    response = pool.create(model="gpt-4o-mini",
+                           messages=[{"role": "user", "content": "hi"}])
+    assert response.choices[0].message.content == "hello"
+    assert broken.hits == 1
+    assert pool.endpoints[0].state == OPEN
+
+    pool.create(model="gpt-4o-mini", messages=[{"role": "user", "content": "hi"}])
+    assert broken.hits == 1
+    assert healthy.hits == 2